@@ -1,9 +1,148 @@
+import hashlib
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import faiss
+import numpy as np
 import streamlit as st
+import torch
 from groq import Groq
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+# Noise lines to drop from report text (QR codes, passport, lab IDs,
+# addresses, page numbers, signatures). The \s* forms are load-bearing:
+# PDF extraction yields column-aligned multi-space and jammed-together
+# tokens ("Lab  ID", "ScanQR"), and the \b anchors prevent matches inside
+# larger words ("prelab", "readdressed"). Compiled once into a single
+# alternation so cleaning does one regex scan per line instead of one
+# per pattern.
+_DROP_PATTERNS = [
+    r"scan\s*qr",
+    r"passport\s*no",
+    r"laboratory\s*test\s*report",
+    r"this\s+is\s+an\s+electronically\s+authenticated\s+report",
+    r"page\s*\d+\s*of\s*\d+",
+    r"\bref\.?\s*id\b",
+    r"\blab\s*id\b",
+    r"\bclient\s*name\b",
+    r"\bapproved\s*on\b",
+    r"\bprinted\s*on\b",
+    r"\bcollected\s*on\b",
+    r"\bprocess\s*at\b",
+    r"\blocation\b",
+    r"\baddress\b",
+    r"\bdr\.\b",
+    r"\bmd\s*path\b",
+    r"\bsignature\b",
+]
+_DROP_RE = re.compile("|".join(f"(?:{p})" for p in _DROP_PATTERNS))
+_SEP_RE = re.compile(r"[-_]{5,}")
+
+# System prompt for the main answer call. Built once; the message dict is
+# immutable by convention and shared across every get_response call.
+_QA_SYSTEM_PROMPT = """
+You are a medical lab report summarizer.
+
+STRICT RULES:
+- NEVER copy/paste raw report text.
+- Ignore QR codes, passport numbers, lab IDs, page numbers, doctor names, signatures, addresses.
+- Only extract health-relevant test names + values + reference ranges + interpretation.
+- If something is missing/unclear, say "Not found in report".
+- Be calm, non-alarming, and human-friendly.
+
+OUTPUT FORMAT (ALWAYS):
+1) Overall Summary (2-4 lines)
+2) Abnormal / Borderline Results (bullets: Test — Value — Range — What it suggests)
+3) Normal Highlights (optional, max 5 bullets)
+4) Recommended Next Steps (bullets)
+5) Lifestyle & Diet Tips (bullets)
+
+If user asks a specific question, answer it within this structure.
+"""
+_QA_SYSTEM_MSG = {"role": "system", "content": _QA_SYSTEM_PROMPT}
+
+
+@lru_cache(maxsize=256)
+def _clean_text_cached(text: str) -> str:
+    """
+    Cached cleaning pass. Module-level so the cache is keyed on the text
+    alone — retrieved top-k chunks recur across chat turns, and the raw
+    report recurs across Streamlit reruns, so hits skip the regex work.
+    """
+    # Filter and de-duplicate consecutive lines in a single pass
+    cleaned_lines = []
+    prev = None
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line or line == prev:
+            continue
+
+        low = line.lower()
+
+        # Drop known noisy lines
+        if _DROP_RE.search(low):
+            continue
+
+        # Drop extremely long header-like lines
+        if len(line) > 180 and ("scan" in low or "mc-" in low):
+            continue
+
+        # Drop repeated separators
+        if _SEP_RE.fullmatch(line):
+            continue
+
+        cleaned_lines.append(line)
+        prev = line
+
+    return "\n".join(cleaned_lines)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_embeddings():
+    """Load the MiniLM embedding model once per worker (multi-second, ~100MB)."""
+    # Prefer the int8 ONNX Runtime path when the optional optimum stack is
+    # installed; otherwise fall back to PyTorch eager mode.
+    try:
+        from agents.onnx_embeddings import OnnxMiniLMEmbeddings
+
+        return OnnxMiniLMEmbeddings(batch_size=64)
+    except Exception:
+        pass
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model_kwargs = {"device": device}
+    if device == "cuda":
+        # fp16 halves bytes moved per matmul; MiniLM retrieval quality is
+        # unaffected. Keep fp32 on CPU where fp16 kernels are slower.
+        model_kwargs["model_kwargs"] = {"torch_dtype": torch.float16}
+    return HuggingFaceEmbeddings(
+        model_name="all-MiniLM-L6-v2",
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": 64, "normalize_embeddings": True},
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _build_vector_store(text_digest: str, _cleaned: str, _agent: "ChatAgent"):
+    """
+    One FAISS store per unique report content. Streamlit keys the cache on
+    `text_digest` only (underscore args are excluded), so reruns with the
+    same report reuse the already-built index instead of re-embedding.
+    """
+    return _agent._build_store(_cleaned)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_groq_client(api_key: str):
+    """Share one Groq client (and its HTTP connection pool) across reruns."""
+    return Groq(api_key=api_key)
 
 
 class ChatAgent:
@@ -15,16 +154,57 @@ class ChatAgent:
     """
 
     def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=900,
-            chunk_overlap=150,
-            separators=["\n\n", "\n", "  ", " ", ""],
-        )
+        self.embeddings = _get_embeddings()
 
-        self.client = Groq(api_key=st.secrets["GROQ_API_KEY"])
+        self.client = _get_groq_client(st.secrets["GROQ_API_KEY"])
         self.model_name = "llama-3.3-70b-versatile"
 
+        # Per-turn LRU caches: question rewrites (saves a Groq round-trip)
+        # and retrieval results (saves an embedding pass + FAISS search)
+        # when the user repeats or re-submits a question.
+        self._rewrite_cache = OrderedDict()
+        self._retrieval_cache = OrderedDict()
+        # The retrieval cache is touched from both the main thread and the
+        # speculative executor thread; the get/move_to_end and
+        # set/popitem sequences must not interleave.
+        self._cache_lock = threading.Lock()
+
+        # Overlaps speculative retrieval with the rewrite round-trip
+        self._executor = ThreadPoolExecutor(max_workers=2)
+
+    @classmethod
+    def get(cls) -> "ChatAgent":
+        """
+        One ChatAgent per Streamlit session: reruns reuse the instance in
+        st.session_state instead of rebuilding the client, caches, and
+        thread pool every script run.
+        """
+        agent = st.session_state.get("_chat_agent")
+        if agent is None:
+            agent = cls()
+            st.session_state._chat_agent = agent
+        return agent
+
+    def _cache_get(self, cache, key):
+        with self._cache_lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache, key, value, cap=64):
+        with self._cache_lock:
+            cache[key] = value
+            if len(cache) > cap:
+                cache.popitem(last=False)
+
+    @staticmethod
+    def _token_jaccard(a: str, b: str) -> float:
+        ta, tb = set(a.lower().split()), set(b.lower().split())
+        if not ta or not tb:
+            return 0.0
+        return len(ta & tb) / len(ta | tb)
+
     # -----------------------------
     # 1) Text Cleaning
     # -----------------------------
@@ -35,66 +215,49 @@ class ChatAgent:
         """
         if not text:
             return ""
+        return _clean_text_cached(text)
 
-        drop_patterns = [
-            r"scan\s*qr",
-            r"passport\s*no",
-            r"laboratory\s*test\s*report",
-            r"this\s+is\s+an\s+electronically\s+authenticated\s+report",
-            r"page\s*\d+\s*of\s*\d+",
-            r"\bref\.?\s*id\b",
-            r"\blab\s*id\b",
-            r"\bclient\s*name\b",
-            r"\bapproved\s*on\b",
-            r"\bprinted\s*on\b",
-            r"\bcollected\s*on\b",
-            r"\bprocess\s*at\b",
-            r"\blocation\b",
-            r"\baddress\b",
-            r"\bdr\.\b",
-            r"\bmd\s*path\b",
-            r"\bsignature\b",
-        ]
-
-        cleaned_lines = []
-        for raw_line in text.splitlines():
-            line = raw_line.strip()
-            if not line:
-                continue
-
-            low = line.lower()
-
-            # Drop known noisy lines
-            if any(re.search(p, low) for p in drop_patterns):
-                continue
-
-            # Drop extremely long header-like lines
-            if len(line) > 180 and ("scan" in low or "mc-" in low):
-                continue
-
-            # Drop repeated separators
-            if re.fullmatch(r"[-_]{5,}", line):
-                continue
-
-            cleaned_lines.append(line)
-
-        # De-duplicate consecutive duplicate lines
-        deduped = []
-        prev = None
-        for ln in cleaned_lines:
-            if ln == prev:
-                continue
-            deduped.append(ln)
-            prev = ln
+    # -----------------------------
+    # 2) Text Splitting
+    # -----------------------------
+    def _fast_split(self, text: str, size: int = 900, overlap: int = 150):
+        """
+        Split cleaned (newline-normalized) text into overlapping chunks.
 
-        return "\n".join(deduped)
+        Scans backward from each chunk end for the nearest paragraph break,
+        newline, or space so chunks end on natural boundaries. Much cheaper
+        than a recursive splitter for text that is already line-normalized.
+        """
+        n = len(text)
+        start = 0
+        while start < n:
+            end = start + size
+            if end >= n:
+                yield text[start:]
+                return
+
+            # Prefer breaking on "\n\n", then "\n", then " " within the
+            # overlap window; otherwise cut hard at `end`.
+            cut = end
+            for sep in ("\n\n", "\n", " "):
+                pos = text.rfind(sep, end - overlap, end)
+                if pos > start:
+                    cut = pos + len(sep)
+                    break
+
+            yield text[start:cut].strip()
+            start = max(cut - overlap, start + 1)
 
     # -----------------------------
-    # 2) Vector Store Initialization
+    # 3) Vector Store Initialization
     # -----------------------------
     def initialize_vector_store(self, text_content: str):
         """
         Create a FAISS vector store from report text.
+
+        Builds are cached on the cleaned content digest, so repeated calls
+        with the same report (every widget interaction reruns the script)
+        skip the embedding pass entirely.
         """
         if not text_content or text_content.strip() == "":
             text_content = "No report context available."
@@ -104,29 +267,92 @@ class ChatAgent:
         if not cleaned.strip():
             cleaned = "No report context available."
 
-        texts = self.text_splitter.split_text(cleaned)
+        digest = hashlib.blake2b(cleaned.encode(), digest_size=16).hexdigest()
+        return _build_vector_store(digest, cleaned, self)
+
+    # Above this many chunks, switch from HNSW to IVF-PQ: product
+    # quantization compresses 384-d fp32 vectors to 48 bytes each and scans
+    # candidates with 8-bit LUT lookups instead of float dot products.
+    # Below it, IVF-PQ has too few points to train its codebooks well.
+    _IVFPQ_MIN_VECTORS = 4096
+
+    @classmethod
+    def _build_index(cls, vectors: np.ndarray):
+        """
+        Build the FAISS index for a set of normalized embeddings: HNSW with
+        fp16 storage for typical single-report corpora, IVF-PQ once a
+        multi-report session grows large enough to train it.
+        """
+        n, dim = vectors.shape
+        if n >= cls._IVFPQ_MIN_VECTORS:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFPQ(
+                quantizer, dim, 64, 48, 8, faiss.METRIC_INNER_PRODUCT
+            )
+            index.train(vectors)
+            index.nprobe = 8
+        else:
+            # ~log(N) search with vectors stored fp16 (scalar-quantized):
+            # MiniLM top-k ordering is unchanged and the distance kernel
+            # moves half the bytes.
+            index = faiss.IndexHNSWSQ(
+                dim, faiss.ScalarQuantizer.QT_fp16, 32, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efConstruction = 80
+            index.hnsw.efSearch = 32
+            if not index.is_trained:
+                index.train(vectors)
+        index.add(vectors)
+        return index
+
+    def _build_store(self, cleaned: str):
+        """
+        Split, embed, and index cleaned report text (uncached; called via
+        `_build_vector_store`).
+        """
+        texts = [chunk for chunk in self._fast_split(cleaned) if chunk]
+
+        # Overlapping windows (and repetitive reports) can yield identical
+        # chunks; embedding them wastes encoder work and dilutes top-k
+        # retrieval with repeats.
+        seen = set()
+        texts = [t for t in texts if not (t in seen or seen.add(t))]
         if not texts:
             texts = [cleaned]
 
-        vectorstore = FAISS.from_texts(texts, self.embeddings)
+        # Embed once, normalize, and index. With normalized vectors inner
+        # product is cosine.
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+        index = self._build_index(vectors)
+
+        docstore = InMemoryDocstore(
+            {str(i): Document(page_content=t) for i, t in enumerate(texts)}
+        )
+        vectorstore = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id={i: str(i) for i in range(len(texts))},
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+        )
         return vectorstore
 
     # -----------------------------
-    # 3) Chat History Formatting
+    # 4) Chat History Formatting
     # -----------------------------
     def _format_chat_history(self, chat_history):
         """
         chat_history format expected:
         [{"role":"user","content":"..."}, {"role":"assistant","content":"..."}]
+
+        Messages are validated where they are appended, so this is just a
+        slice + shallow copy of the last 6 entries.
         """
-        messages = []
-        for msg in chat_history:
-            if "role" in msg and "content" in msg:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-        return messages
+        return [{"role": m["role"], "content": m["content"]} for m in chat_history[-6:]]
 
     # -----------------------------
-    # 4) Contextualize Query (ONLY question rewrite)
+    # 5) Contextualize Query (ONLY question rewrite)
     # -----------------------------
     def _contextualize_query(self, query: str, chat_history):
         """
@@ -136,11 +362,9 @@ class ChatAgent:
         if not chat_history:
             return query
 
-        recent_history = chat_history[-4:]  # last 2 exchanges
         history_text = "\n".join(
             f"{'User' if m['role']=='user' else 'Assistant'}: {m['content']}"
-            for m in recent_history
-            if "role" in m and "content" in m
+            for m in chat_history[-4:]  # last 2 exchanges
         )
 
         messages = [
@@ -173,27 +397,77 @@ class ChatAgent:
             return query
 
     # -----------------------------
-    # 5) Main Response (Human-friendly)
+    # 6) Retrieval
+    # -----------------------------
+    # Context fed to the LLM is capped (~600 tokens) and low-similarity
+    # chunks are dropped — input tokens are the dominant per-turn cost.
+    _MAX_CONTEXT_CHARS = 2400
+    _MIN_SIMILARITY = 0.2
+
+    def _retrieve(self, vectorstore, query_text: str):
+        """
+        Cached top-k retrieval (docs with scores) against a vector store.
+        """
+        key = (id(vectorstore), query_text)
+        results = self._cache_get(self._retrieval_cache, key)
+        if results is None:
+            results = vectorstore.similarity_search_with_score(query_text, k=6)
+            self._cache_put(self._retrieval_cache, key, results)
+        return results
+
+    def _select_context(self, results) -> str:
+        """
+        Greedily take the best-scoring chunks until the character budget is
+        reached, skipping chunks too dissimilar to the query. Scores are
+        inner products on normalized vectors, so higher is more similar.
+        """
+        parts = []
+        used = 0
+        for doc, score in sorted(results, key=lambda r: r[1], reverse=True):
+            if score < self._MIN_SIMILARITY or not doc.page_content:
+                continue
+            if used + len(doc.page_content) > self._MAX_CONTEXT_CHARS:
+                break
+            parts.append(doc.page_content)
+            used += len(doc.page_content) + 2
+        return "\n\n".join(parts)
+
+    # -----------------------------
+    # 7) Main Response (Human-friendly)
     # -----------------------------
     def get_response(self, query: str, vectorstore, chat_history=None):
         """
         Uses RAG context + Groq LLM to produce a human-friendly medical explanation.
+
+        Generator: yields response text incrementally as Groq streams it,
+        so the UI can render tokens as they arrive (st.write_stream)
+        instead of blocking on the full completion.
         """
         if chat_history is None:
             chat_history = []
 
-        # 1) Contextualize the question
-        contextualized_query = self._contextualize_query(query, chat_history)
-
-        # 2) Retrieve relevant chunks
+        # 1) + 2) Contextualize and retrieve, overlapped: kick off a
+        # speculative retrieval of the raw query in the background while the
+        # rewrite round-trip runs, and reuse it unless the rewritten
+        # question drifted too far from the original.
         context = ""
         try:
-            retriever = vectorstore.as_retriever(search_kwargs={"k": 4})
-            docs = retriever.get_relevant_documents(contextualized_query)
-            context = "\n\n".join([d.page_content for d in docs if d.page_content])
-
-            # Clean again (safe)
-            context = self.clean_report_text(context)
+            speculative = self._executor.submit(self._retrieve, vectorstore, query)
+
+            last_msg = chat_history[-1].get("content", "") if chat_history else ""
+            rewrite_key = (query, len(chat_history), last_msg)
+            contextualized_query = self._cache_get(self._rewrite_cache, rewrite_key)
+            if contextualized_query is None:
+                contextualized_query = self._contextualize_query(query, chat_history)
+                self._cache_put(self._rewrite_cache, rewrite_key, contextualized_query)
+
+            if self._token_jaccard(query, contextualized_query) >= 0.7:
+                results = speculative.result()
+            else:
+                results = self._retrieve(vectorstore, contextualized_query)
+            # Chunks come from text already cleaned at index build time, so
+            # no second cleaning pass is needed here.
+            context = self._select_context(results)
 
             if context.strip() == "No report context available.":
                 context = ""
@@ -201,31 +475,11 @@ class ChatAgent:
             context = ""
 
         # 3) Prompt for a friendly structured output
-        qa_system_prompt = """
-You are a medical lab report summarizer.
-
-STRICT RULES:
-- NEVER copy/paste raw report text.
-- Ignore QR codes, passport numbers, lab IDs, page numbers, doctor names, signatures, addresses.
-- Only extract health-relevant test names + values + reference ranges + interpretation.
-- If something is missing/unclear, say "Not found in report".
-- Be calm, non-alarming, and human-friendly.
-
-OUTPUT FORMAT (ALWAYS):
-1) Overall Summary (2-4 lines)
-2) Abnormal / Borderline Results (bullets: Test — Value — Range — What it suggests)
-3) Normal Highlights (optional, max 5 bullets)
-4) Recommended Next Steps (bullets)
-5) Lifestyle & Diet Tips (bullets)
-
-If user asks a specific question, answer it within this structure.
-"""
-
-        messages = [{"role": "system", "content": qa_system_prompt}]
+        messages = [_QA_SYSTEM_MSG]
 
         # Add recent chat history (optional)
         if chat_history:
-            messages.extend(self._format_chat_history(chat_history[-6:]))
+            messages.extend(self._format_chat_history(chat_history))
 
         # Provide context + question
         if context.strip():
@@ -242,14 +496,17 @@ If user asks a specific question, answer it within this structure.
 
         messages.append({"role": "user", "content": user_message})
 
-        # 4) Call Groq
+        # 4) Call Groq (streamed)
         try:
-            resp = self.client.chat.completions.create(
+            stream = self.client.chat.completions.create(
                 model=self.model_name,
                 messages=messages,
                 temperature=0.2,
                 max_tokens=700,
+                stream=True,
             )
-            return resp.choices[0].message.content
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            yield f"Error generating response: {str(e)}"
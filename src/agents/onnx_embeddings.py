@@ -0,0 +1,99 @@
+"""
+ONNX Runtime-backed MiniLM embedder.
+
+Runs `all-MiniLM-L6-v2` through an int8-quantized ONNX graph instead of
+PyTorch eager mode — int8 matmuls cut memory traffic and use VNNI on
+recent x86, which speeds up the encoder several-fold on CPU-only deploys.
+
+Requires the optional `optimum[onnxruntime]` stack; `ChatAgent` falls back
+to the PyTorch `HuggingFaceEmbeddings` path when it is unavailable.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+_CACHE_DIR = Path.home() / ".cache" / "hia" / "minilm-onnx"
+_QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def _ensure_quantized_model() -> Path:
+    """
+    Export MiniLM to ONNX and int8-quantize it once, reusing the cached
+    artifact on subsequent loads.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    if not (_CACHE_DIR / _QUANTIZED_FILE).exists():
+        model = ORTModelForFeatureExtraction.from_pretrained(_MODEL_NAME, export=True)
+        model.save_pretrained(_CACHE_DIR)
+        quantizer = ORTQuantizer.from_pretrained(_CACHE_DIR)
+        quantizer.quantize(
+            save_dir=_CACHE_DIR,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False),
+        )
+    return _CACHE_DIR
+
+
+class OnnxMiniLMEmbeddings(Embeddings):
+    """
+    Drop-in replacement for `HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")`
+    producing the same normalized 384-d sentence embeddings.
+    """
+
+    def __init__(self, batch_size: int = 64):
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        model_dir = _ensure_quantized_model()
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+        session_options.graph_optimization_level = (
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir,
+            file_name=_QUANTIZED_FILE,
+            provider="CPUExecutionProvider",
+            session_options=session_options,
+        )
+        self.batch_size = batch_size
+
+    def _encode(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i : i + self.batch_size]
+            encoded = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np",
+            )
+            output = self.model(**encoded)
+            hidden = np.asarray(output.last_hidden_state, dtype=np.float32)
+
+            # Mean pooling over non-padding tokens, then L2 normalization —
+            # same as sentence-transformers' pooling for this model.
+            mask = np.asarray(encoded["attention_mask"], dtype=np.float32)[..., None]
+            summed = (hidden * mask).sum(axis=1)
+            counts = np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings = summed / counts
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+            vectors.extend(embeddings.tolist())
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._encode(list(texts))
+
+    def embed_query(self, text):
+        return self._encode([text])[0]
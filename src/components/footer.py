@@ -1,9 +1,8 @@
 import streamlit as st
 
-def show_footer(in_sidebar: bool = False):
-    margin = "0" if in_sidebar else "2rem"
 
-    html = f"""
+def _build_footer_html(margin: str) -> str:
+    return f"""
     <div style="
         text-align: center;
         padding: 0.9rem;
@@ -48,4 +47,11 @@ def show_footer(in_sidebar: bool = False):
     </div>
     """
 
-    st.markdown(html, unsafe_allow_html=True)
+
+# The only variable is the top margin, so render both variants once at
+# import time instead of rebuilding ~1KB of HTML on every rerun.
+_FOOTER_HTML = {True: _build_footer_html("0"), False: _build_footer_html("2rem")}
+
+
+def show_footer(in_sidebar: bool = False):
+    st.markdown(_FOOTER_HTML[in_sidebar], unsafe_allow_html=True)
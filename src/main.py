@@ -108,14 +108,19 @@ def handle_chat_input(messages):
         with st.spinner("Thinking..."):
             response = get_chat_response(prompt, context_text, messages)
 
+        if isinstance(response, str):
+            # Setup errors come back as plain strings
             st.success(response)
+        else:
+            # Render tokens as they stream in; returns the full text
+            response = st.write_stream(response)
 
-            # Save AI response
-            st.session_state.auth_service.save_chat_message(
-                st.session_state.current_session["id"], response, role="assistant"
-            )
-            # Rerun to update history display properly
-            st.rerun()
+        # Save AI response
+        st.session_state.auth_service.save_chat_message(
+            st.session_state.current_session["id"], response, role="assistant"
+        )
+        # Rerun to update history display properly
+        st.rerun()
 
 
 def show_user_greeting():
@@ -17,7 +17,7 @@ def init_analysis_state():
                 st.session_state.chat_agent = None
                 st.session_state.chat_agent_error = "GROQ_API_KEY not found in secrets. Please add it to .streamlit/secrets.toml"
             else:
-                st.session_state.chat_agent = ChatAgent()
+                st.session_state.chat_agent = ChatAgent.get()
                 st.session_state.chat_agent_error = None
         except KeyError as e:
             # Missing secret key
@@ -60,7 +60,12 @@ def generate_analysis(data, system_prompt, check_only=False, session_id=None):
 
 
 def get_chat_response(query, context_text, chat_history):
-    """Generate chat response using RAG."""
+    """
+    Generate chat response using RAG.
+
+    Returns a generator of streamed response text on success (render with
+    st.write_stream), or a plain error string when setup fails.
+    """
     init_analysis_state()
 
     # Check if chat agent was successfully initialized